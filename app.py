@@ -1,10 +1,15 @@
 # 主应用文件：创建Web服务，处理前端请求
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from core.weather import get_weather_data, format_weather_data, get_weather_alerts
-from core.ai_advisor import get_ai_advice
-from core.database import save_weather_record, save_advice_record, get_last_weather_record, get_weather_history, get_advice_history
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context
+from core.weather import get_weather_data, format_weather_data, get_weather_alerts, project_weather_data, validate_weather_projection
+from core.ai_advisor import get_ai_advice, should_save_advice
+from core.database import save_weather_record, save_advice_record, get_last_weather_record, get_weather_history, get_advice_history, get_alert_changes, iter_weather_records, get_last_advised_weather_record, get_weather_record
+from core.export import iter_export, EXPORT_FORMATS
+from core.advice_jobs import submit_advice_job, get_advice_job
+from config import AdviceJobConfig  # 导入后台任务配置
 from datetime import datetime
 import requests
+import click
+import copy
 
 # 创建Flask应用实例
 app = Flask(__name__)
@@ -30,6 +35,70 @@ def serve_static(filename):
     """
     return send_from_directory('static', filename)
 
+def fetch_and_save_weather(lat, lon, source='manual'):
+    """
+    获取天气数据并保存到数据库，组装返回给前端的天气部分
+    :param lat: 纬度
+    :param lon: 经度
+    :param source: 记录来源（'auto'或'manual'）
+    :return: 天气响应字典，获取天气失败返回None
+    """
+    # 获取天气数据
+    weather_data = get_weather_data(lat, lon)
+    if not weather_data:
+        return None
+
+    # 获取预警信息
+    alerts = get_weather_alerts(weather_data)
+    
+    # 保存到数据库
+    record_id = save_weather_record(lat, lon, weather_data, alerts, source=source)
+    
+    # 获取上一的天气记录（排除当前刚插入的记录）
+    previous_record = get_last_weather_record(lat, lon, exclude_id=record_id)
+    
+    # 相比上一条记录新增/解除的预警
+    alert_changes = None
+    if record_id and previous_record:
+        alert_changes = get_alert_changes(previous_record['id'], record_id, weather_data.get('alerts') or [])
+
+    return {
+        'weather': weather_data,
+        'formatted': format_weather_data(weather_data),
+        'alerts': alerts,
+        'record_id': record_id,
+        'previous_record': previous_record,
+        'alert_changes': alert_changes
+    }
+
+def project_weather_result(weather_result, view=None, fields=None):
+    """
+    按视图或字段列表裁剪天气响应中的 weather 和 previous_record.weather_data
+    :param weather_result: fetch_and_save_weather 的返回值
+    :param view: 预设视图名称（'current'、'summary'、'full'）
+    :param fields: 逗号分隔的字段路径或字段路径列表（可选，优先于 view）
+    :return: 裁剪后的新字典（不修改原数据）
+    """
+    projected = dict(weather_result)
+    projected['weather'] = project_weather_data(weather_result['weather'], view, fields)
+    previous_record = weather_result.get('previous_record')
+    if previous_record:
+        projected['previous_record'] = {
+            **previous_record,
+            'weather_data': project_weather_data(previous_record['weather_data'], view, fields)
+        }
+    return projected
+
+def weather_json_response(payload, view=None, fields=None):
+    """
+    生成天气JSON响应，并在响应头 X-Payload-Bytes 和日志中记录响应体积
+    """
+    response = jsonify(payload)
+    payload_bytes = len(response.get_data())
+    response.headers['X-Payload-Bytes'] = str(payload_bytes)
+    print(f"[天气] 响应体积: {payload_bytes} bytes（view={view or ('fields' if fields else 'full')}）")
+    return response
+
 @app.route('/get_weather', methods=['POST'])
 def get_weather():
     """
@@ -46,28 +115,22 @@ def get_weather():
         if not lat or not lon:
             return jsonify({'error': '缺少经纬度参数'}), 400
         
-        # 获取天气数据
-        weather_data = get_weather_data(lat, lon)
+        # 响应裁剪：view 为预设视图，fields 为逗号分隔的字段路径或字段路径列表
+        view = data.get('view')
+        fields = data.get('fields')
+        try:
+            validate_weather_projection(view, fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if weather_data:
-            # 获取预警信息
-            alerts = get_weather_alerts(weather_data)
-            
-            # 保存到数据库
-            record_id = save_weather_record(lat, lon, weather_data, alerts, source='manual')
-            
-            # 获取上一的天气记录（排除当前刚插入的记录）
-            previous_record = get_last_weather_record(lat, lon, exclude_id=record_id)
-            
+        weather_result = fetch_and_save_weather(lat, lon, source='manual')
+        
+        if weather_result:
             # 返回JSON响应
-            return jsonify({
+            return weather_json_response({
                 'success': True,
-                'weather': weather_data,
-                'formatted': format_weather_data(weather_data),
-                'alerts': alerts,
-                'record_id': record_id,
-                'previous_record': previous_record
-            })
+                **project_weather_result(weather_result, view, fields)
+            }, view, fields)
         else:
             # 返回错误
             return jsonify({'error': '获取天气数据失败'}), 500
@@ -78,6 +141,103 @@ def get_weather():
         traceback.print_exc()  # 打印完整错误报告
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
 
+def submit_advice_for_record(lat, lon, weather_result, force_update=False):
+    """
+    为刚保存的天气记录提交后台建议任务：与该位置最近一次生成建议时的天气比较，由任务线程调用大模型
+    :param lat: 纬度
+    :param lon: 经度
+    :param weather_result: fetch_and_save_weather 的返回值
+    :param force_update: 是否强制生成建议
+    :return: 任务状态字典，队列已满时返回None
+    """
+    last_advised = get_last_advised_weather_record(lat, lon)
+    previous_record = weather_result.get('previous_record')
+
+    # get_ai_advice 会裁剪传入的天气数据，这里传入副本，保证返回给前端的天气数据完整
+    return submit_advice_job(
+        copy.deepcopy(weather_result['weather']),
+        last_advised['weather_data'] if last_advised else None,
+        previous_record['weather_data'] if previous_record else None,
+        weather_result.get('record_id'),
+        force_update
+    )
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    """
+    天气+建议一次性刷新API接口
+    获取并保存天气，同时提交后台建议任务（服务端与上次生成建议时的天气比较后判断是否更新建议），
+    并短暂等待任务结果：索引命中、无需更新等快速判断直接随天气和预警一起返回；
+    需要调用大模型的慢任务只返回任务状态，结果通过 /advice_jobs/<job_id> 查询
+    """
+    try:
+        data = request.get_json()
+        lat = data.get('lat')
+        lon = data.get('lon')
+        force_update = data.get('force_update', False)
+        source = data.get('source', 'auto')
+        view = data.get('view')
+        fields = data.get('fields')
+
+        if not lat or not lon:
+            return jsonify({'error': '缺少经纬度参数'}), 400
+        try:
+            validate_weather_projection(view, fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        weather_result = fetch_and_save_weather(lat, lon, source=source)
+        if not weather_result:
+            return jsonify({'error': '获取天气数据失败'}), 500
+
+        advice_job = submit_advice_for_record(lat, lon, weather_result, force_update)
+        if advice_job and advice_job['status'] not in ('done', 'failed'):
+            # 在上限内等待任务完成，快速判断无需客户端再轮询
+            advice_job = get_advice_job(advice_job['job_id'], wait=AdviceJobConfig.MAX_WAIT) or advice_job
+        payload = {
+            'success': True,
+            **project_weather_result(weather_result, view, fields),
+            'advice_job': advice_job
+        }
+        if advice_job is None:
+            payload['advice_error'] = '建议任务繁忙，请稍后再试'
+        elif advice_job['status'] == 'done':
+            payload['advice'] = advice_job['advice']
+            payload['need_update'] = advice_job['need_update']
+        return weather_json_response(payload, view, fields)
+
+    except Exception as e:
+        import traceback
+        print("后端报错：", e)
+        traceback.print_exc()
+        return jsonify({'error': f'服务器错误: {str(e)}'}), 500
+
+@app.route('/get_alert_changes', methods=['POST'])
+def alert_changes():
+    """
+    获取预警变化API接口
+    返回相对指定天气记录新增和已解除的预警
+    """
+    try:
+        data = request.get_json()
+        since_record_id = data.get('since_record_id')
+        record_id = data.get('record_id')  # 可选，缺省为同一位置最新记录
+
+        if not since_record_id:
+            return jsonify({'error': '缺少基准记录ID参数'}), 400
+
+        changes = get_alert_changes(since_record_id, record_id)
+        if changes is None:
+            return jsonify({'error': '未找到对应的天气记录'}), 404
+
+        return jsonify({
+            'success': True,
+            **changes
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'获取预警变化失败: {str(e)}'}), 500
+
 @app.route('/get_location_name', methods=['POST'])
 def get_location_name():
     """
@@ -126,16 +286,66 @@ def get_advice():
         advice = ai_result.get('advice')
         need_update = ai_result.get('need_update', True)
 
-        if record_id and advice:
+        if record_id and should_save_advice(ai_result):
             save_advice_record(record_id, advice, update_type='forced' if force_update else 'auto')
         return jsonify({
             'success': True,
             'advice': advice,
-            'need_update': need_update
+            'need_update': need_update,
+            'stages': ai_result.get('stages', [])
         })
 
     except Exception as e:
         return jsonify({'error': f'生成建议失败: {str(e)}'}), 500
+@app.route('/advice_jobs', methods=['POST'])
+def create_advice_job():
+    """
+    提交AI建议后台任务API接口
+    参数与 /get_advice 相同，立即返回任务ID，建议在后台工作线程中生成
+    同一天气记录、同一模式的进行中任务会合并为一个
+    """
+    try:
+        data = request.get_json()
+        weather_data = data.get('weather_data')
+        record_id = data.get('record_id')
+
+        # 前端只拿到裁剪后的天气数据，有记录ID时必须读取完整天气数据生成建议，
+        # 读不到时直接报错，不用缺少预报和预警的裁剪数据生成建议
+        if record_id:
+            record = get_weather_record(record_id)
+            if record is None:
+                return jsonify({'error': '未找到对应的天气记录'}), 404
+            weather_data = record['weather_data']
+
+        if not weather_data:
+            return jsonify({'error': '缺少天气数据参数'}), 400
+
+        job = submit_advice_job(
+            weather_data,
+            data.get('last_update_weather_data'),
+            data.get('previous_weather_data'),
+            record_id,
+            data.get('force_update', False)
+        )
+        if job is None:
+            return jsonify({'error': '建议任务繁忙，请稍后再试'}), 503
+
+        return jsonify({'success': True, **job}), 202
+
+    except Exception as e:
+        return jsonify({'error': f'提交建议任务失败: {str(e)}'}), 500
+
+@app.route('/advice_jobs/<job_id>', methods=['GET'])
+def advice_job_status(job_id):
+    """
+    查询AI建议后台任务API接口
+    wait 参数（秒）表示最长等待任务完成的时间，上限很短（AdviceJobConfig.MAX_WAIT），由前端退避轮询
+    """
+    job = get_advice_job(job_id, request.args.get('wait', 0, type=float))
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, **job})
+
 '''功能已迁移至前端
 @app.route('/start_scheduler', methods=['POST'])
 def start_scheduler():
@@ -217,6 +427,49 @@ def get_history():
         return jsonify({'error': f'获取历史记录失败: {str(e)}'}), 500
     
 
+@app.route('/export_history', methods=['GET'])
+def export_history():
+    """
+    历史记录流式导出API接口
+    参数：lat、lon（必填），format（ndjson/csv，默认ndjson），fields（逗号分隔的字段投影），
+    start、end（UTC时间 'YYYY-MM-DD HH:MM:SS'，可选）
+    数据库游标分批读取并逐行输出，内存占用与导出行数无关
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    export_format = request.args.get('format', 'ndjson')
+    fields = request.args.get('fields')
+    start = request.args.get('start')
+    end = request.args.get('end')
+
+    if lat is None or lon is None:
+        return jsonify({'error': '缺少经纬度参数'}), 400
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'不支持的导出格式: {export_format}'}), 400
+
+    records = iter_weather_records(lat, lon, start=start, end=end)
+    return Response(
+        stream_with_context(iter_export(records, export_format, fields)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename=weather_history.{export_format}'}
+    )
+
+@app.cli.command('export-history')
+@click.option('--lat', type=float, required=True, help='纬度')
+@click.option('--lon', type=float, required=True, help='经度')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson', help='导出格式')
+@click.option('--fields', default=None, help='逗号分隔的字段投影，如 id,timestamp,current.temp')
+@click.option('--start', default=None, help='起始时间（UTC，YYYY-MM-DD HH:MM:SS）')
+@click.option('--end', default=None, help='结束时间（UTC，YYYY-MM-DD HH:MM:SS）')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='输出文件，默认标准输出')
+def export_history_command(lat, lon, export_format, fields, start, end, output):
+    """
+    命令行流式导出历史记录：flask --app app export-history --lat 24.48 --lon 118.09 --format csv
+    """
+    records = iter_weather_records(lat, lon, start=start, end=end)
+    for line in iter_export(records, export_format, fields):
+        output.write(line)
+
 '''功能已迁移至前端
 @app.route('/register_callback', methods=['POST'])
 def register_callback():
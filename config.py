@@ -9,9 +9,33 @@ class DeepSeekConfig:
     API_KEY = os.getenv('DEEPSEEK_API_KEY')  # 从环境变量获取API密钥
     API_URL = "https://api.deepseek.com"    # API基础地址
     MODEL = "deepseek-chat"                  # 使用的模型名称
+    CLASSIFIER_MODEL = os.getenv('DEEPSEEK_CLASSIFIER_MODEL', MODEL)  # 判断是否需要更新建议的模型（可配置为更便宜的模型）
+    CLASSIFIER_MAX_TOKENS = 16               # 判断阶段的最大输出token数
+    TIMEOUT = int(os.getenv('DEEPSEEK_TIMEOUT', '60'))  # 单次API请求超时时间（秒），避免挂起的请求占满建议任务线程
 
 # OpenWeatherMap API配置
 class WeatherConfig:
     API_KEY = os.getenv('OWM_API_KEY')       # 从环境变量获取API密钥
     API_URL = "https://api.openweathermap.org/data/3.0/onecall"  # API地址
-    UNITS = "metric"                         # 使用公制单位（摄氏度）
\ No newline at end of file
+    UNITS = "metric"                         # 使用公制单位（摄氏度）
+
+# 数据库配置
+class DatabaseConfig:
+    WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', '0') == '1'          # 是否开启后写模式（批量异步落盘）
+    BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '200'))         # 每次批量提交的最大记录数
+    FLUSH_INTERVAL = float(os.getenv('DB_WRITE_FLUSH_INTERVAL', '0.5'))  # 批量提交的最长等待时间（秒）
+    ID_BLOCK_SIZE = int(os.getenv('DB_ID_BLOCK_SIZE', '100'))         # 每次预留的记录ID数量
+
+# AI建议后台任务配置
+class AdviceJobConfig:
+    WORKERS = int(os.getenv('ADVICE_WORKERS', '2'))          # 并发调用大模型的工作线程数
+    QUEUE_SIZE = int(os.getenv('ADVICE_QUEUE_SIZE', '32'))   # 等待队列长度上限，超出时拒绝新任务
+    RESULT_TTL = int(os.getenv('ADVICE_RESULT_TTL', '600'))  # 已完成任务结果保留时间（秒）
+    MAX_WAIT = 1                                             # 查询任务时最长等待时间（秒），保持短轮询不占用Web线程
+
+# 相似天气建议索引配置
+class AdviceIndexConfig:
+    ENABLED = os.getenv('ADVICE_INDEX_ENABLED', '1') == '1'          # 是否启用相似天气建议复用
+    MAX_DISTANCE = float(os.getenv('ADVICE_INDEX_MAX_DISTANCE', '1.0'))  # 视为相似天气的最大特征距离
+    USE_FOR_FORCED = os.getenv('ADVICE_INDEX_USE_FOR_FORCED', '0') == '1'  # 强制更新（“给我点建议”）时是否也复用
+    MAX_ENTRIES = int(os.getenv('ADVICE_INDEX_MAX_ENTRIES', '5000'))  # 索引最多保留的建议数量
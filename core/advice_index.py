@@ -0,0 +1,192 @@
+# 相似天气建议索引模块：为历史建议对应的天气状态建立特征向量，相似天气直接复用已有建议
+
+import threading
+import numpy as np
+from config import AdviceIndexConfig  # 导入索引配置
+from core.database import iter_advice_with_weather
+
+# 天气状况分组（OpenWeatherMap 天气代码的百位）：雷暴、毛毛雨、雨、雪、大气现象（雾霾等）、晴/云
+CONDITION_GROUPS = [2, 3, 5, 6, 7, 8]
+
+# 数值特征的归一化尺度：差值达到该尺度时，该维度贡献的距离为1
+FEATURE_SCALES = {
+    'temp': 5.0,        # 温度（°C）
+    'feels_like': 5.0,  # 体感温度（°C）
+    'humidity': 25.0,   # 湿度（%）
+    'wind_speed': 5.0,  # 风速（m/s）
+    'precipitation': 2.0  # 近1小时降水量（mm）
+}
+CONDITION_WEIGHT = 1.0  # 天气状况不同时贡献的距离（one-hot 两维各差 CONDITION_WEIGHT）
+ALERT_WEIGHT = 2.0      # 有无预警不同时贡献的距离（具体预警种类另由 alert_events 精确匹配）
+
+# 复用建议时添加的头部，同时用于识别由索引生成的建议（这类建议不再加入索引）
+SIMILAR_ADVICE_MARK = '> 🔁 相似天气建议'
+
+def extract_features(weather_data):
+    """
+    将天气数据转换为归一化的特征向量
+    :param weather_data: 天气数据字典（需包含 current）
+    :return: numpy 向量，缺少关键字段时返回None
+    """
+    if not weather_data or 'current' not in weather_data:
+        return None
+    current = weather_data['current']
+    if current.get('temp') is None:
+        return None
+
+    rain = current.get('rain') or {}
+    snow = current.get('snow') or {}
+    values = {
+        'temp': current.get('temp'),
+        'feels_like': current.get('feels_like', current.get('temp')),
+        'humidity': current.get('humidity') or 0,
+        'wind_speed': current.get('wind_speed') or 0,
+        'precipitation': rain.get('1h', 0) + snow.get('1h', 0)
+    }
+    numeric = [float(values[name]) / scale for name, scale in FEATURE_SCALES.items()]
+
+    condition = [0.0] * len(CONDITION_GROUPS)
+    weather = current.get('weather') or []
+    if weather and weather[0].get('id'):
+        group = int(weather[0]['id']) // 100
+        if group in CONDITION_GROUPS:
+            condition[CONDITION_GROUPS.index(group)] = CONDITION_WEIGHT / np.sqrt(2)
+
+    alert = [ALERT_WEIGHT if weather_data.get('alerts') else 0.0]
+    return np.array(numeric + condition + alert, dtype=np.float32)
+
+def alert_events(weather_data):
+    """
+    提取天气数据中生效预警的事件名集合（忽略格式异常的预警）
+    :param weather_data: 天气数据字典
+    :return: 事件名的 frozenset，无预警时为空集合
+    """
+    return frozenset(alert.get('event') or '' for alert in (weather_data or {}).get('alerts') or []
+                     if isinstance(alert, dict))
+
+def feature_distance(features_a, features_b):
+    """
+    计算两个特征向量之间的欧氏距离
+    """
+    return float(np.linalg.norm(features_a - features_b))
+
+def fill_location_details(advice, weather_data):
+    """
+    为复用的建议补充当前位置的实时天气信息
+    :param advice: 命中的历史建议文本
+    :param weather_data: 当前位置的天气数据
+    :return: 补充头部后的建议文本
+    """
+    current = weather_data.get('current', {})
+    weather = current.get('weather') or [{}]
+    location = weather_data.get('timezone') or f"{weather_data.get('lat')}, {weather_data.get('lon')}"
+    header = (
+        f"{SIMILAR_ADVICE_MARK}（📍{location}：{current.get('temp', 'N/A')}°C，"
+        f"体感 {current.get('feels_like', 'N/A')}°C，湿度 {current.get('humidity', 'N/A')}%，"
+        f"{weather[0].get('description', '')}）\n\n"
+    )
+    return header + advice
+
+class AdviceIndex:
+    """
+    相似天气建议索引：特征矩阵 + 对应建议，最近邻查询为一次向量化距离计算
+    预警种类不计入距离而是精确匹配：只复用生效预警事件集合与当前完全相同的建议
+    首次使用时从数据库按从旧到新的顺序加载最近的建议记录，之后新生成的建议追加到索引；
+    矩阵行的顺序即新旧顺序，淘汰时丢弃前半部分（最早的建议）
+    """
+
+    def __init__(self, max_entries=5000):
+        self._max_entries = max_entries
+        self._matrix = None  # 形状 (容量, 特征维度)
+        self._entries = []   # 与矩阵行一一对应的建议信息
+        self._alert_codes = np.zeros(64, dtype=np.int32)  # 与矩阵行一一对应的预警集合编号
+        self._alert_code_map = {}  # 预警事件集合 -> 编号
+        self._size = 0
+        self._loaded = False
+        self._excluded_texts = set()  # 不加入索引的建议文本（失败提示），首次加载时设置
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        # 调用方需持有锁
+        if self._loaded:
+            return
+        self._loaded = True
+        # 延迟导入，避免与 ai_advisor 循环依赖；失败提示不是真正的建议，不能加入索引
+        from core.ai_advisor import ADVICE_FAILURE_TEXTS
+        self._excluded_texts = set(ADVICE_FAILURE_TEXTS)
+        try:
+            for record in iter_advice_with_weather(limit=self._max_entries,
+                                                   exclude_texts=self._excluded_texts):
+                self._append(record['weather_data'], record['advice_text'])
+        except Exception as e:
+            print(f"[建议索引] 加载历史建议失败: {e}")
+
+    def _append(self, weather_data, advice):
+        # 调用方需持有锁
+        if not advice or advice in self._excluded_texts or advice.startswith(SIMILAR_ADVICE_MARK):
+            return
+        features = extract_features(weather_data)
+        if features is None:
+            return
+        if self._size >= self._max_entries:
+            # 超出上限时淘汰最早的一半
+            keep = self._size // 2
+            self._matrix[:keep] = self._matrix[self._size - keep:self._size]
+            self._alert_codes[:keep] = self._alert_codes[self._size - keep:self._size]
+            self._entries = self._entries[self._size - keep:]
+            self._size = keep
+        if self._matrix is None:
+            self._matrix = np.zeros((64, features.shape[0]), dtype=np.float32)
+        elif self._size == self._matrix.shape[0]:
+            # 容量不足时按倍数扩容，摊还追加成本
+            grown = np.zeros((self._matrix.shape[0] * 2, self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            codes = np.zeros(grown.shape[0], dtype=np.int32)
+            codes[:self._size] = self._alert_codes[:self._size]
+            self._alert_codes = codes
+        events = alert_events(weather_data)
+        code = self._alert_code_map.setdefault(events, len(self._alert_code_map))
+        self._matrix[self._size] = features
+        self._alert_codes[self._size] = code
+        self._entries.append({'advice': advice, 'timezone': weather_data.get('timezone')})
+        self._size += 1
+
+    def add(self, weather_data, advice):
+        """
+        将新生成的建议加入索引
+        :param weather_data: 生成建议时的天气数据
+        :param advice: 建议文本
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._append(weather_data, advice)
+
+    def search(self, weather_data, max_distance):
+        """
+        查找与给定天气最相似的历史建议
+        :param weather_data: 当前天气数据
+        :param max_distance: 最大特征距离
+        :return: 字典 {'advice', 'distance', 'timezone'}，没有足够相似的建议时返回None
+        """
+        features = extract_features(weather_data)
+        if features is None:
+            return None
+        events = alert_events(weather_data)
+        with self._lock:
+            self._ensure_loaded()
+            code = self._alert_code_map.get(events)
+            if self._size == 0 or code is None:
+                # 没有任何建议是在相同预警下生成的
+                return None
+            distances = np.linalg.norm(self._matrix[:self._size] - features, axis=1)
+            # 预警事件集合不同的建议不能复用（例如高温预警的建议不能用于台风预警）
+            distances[self._alert_codes[:self._size] != code] = np.inf
+            # 距离相同时优先返回最新的建议（矩阵按从旧到新的顺序追加）
+            best = self._size - 1 - int(np.argmin(distances[::-1]))
+            if distances[best] > max_distance:
+                return None
+            return {**self._entries[best], 'distance': float(distances[best])}
+
+# 全局索引
+advice_index = AdviceIndex(max_entries=AdviceIndexConfig.MAX_ENTRIES)
@@ -0,0 +1,174 @@
+# AI建议后台任务模块：在独立的工作线程池中调用大模型，避免占用Web请求线程
+
+import hashlib
+import json
+import queue
+import threading
+import time
+import uuid
+from config import AdviceJobConfig  # 导入后台任务配置
+from core.ai_advisor import get_ai_advice, should_save_advice
+from core.database import save_advice_record
+
+class AdviceJobManager:
+    """
+    AI建议任务管理器
+    - 固定数量的工作线程从有界队列中取任务执行
+    - 同一天气记录、同一模式（强制/自动）的进行中任务会合并为一个
+    - 任务完成后通过 save_advice_record 持久化建议
+    """
+
+    def __init__(self, workers=2, queue_size=32, result_ttl=600):
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._result_ttl = result_ttl
+        self._jobs = {}      # 任务ID -> 任务字典
+        self._inflight = {}  # 去重键 -> 进行中的任务ID
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        # 首次提交任务时再启动工作线程，避免导入模块时产生线程
+        if self._threads:
+            return
+        for index in range(self._workers):
+            thread = threading.Thread(target=self._worker, name=f'advice-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _job_key(weather_data, record_id, force_update):
+        mode = 'forced' if force_update else 'auto'
+        if record_id:
+            return f'{record_id}:{mode}'
+        # 没有记录ID时按天气数据内容去重
+        digest = hashlib.sha1(json.dumps(weather_data, sort_keys=True).encode('utf-8')).hexdigest()
+        return f'{digest}:{mode}'
+
+    def _purge_expired(self):
+        # 清理超过保留时间的已完成任务（调用方需持有锁）
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] and now - job['finished_at'] > self._result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _public_view(job):
+        view = {
+            'job_id': job['id'],
+            'status': job['status'],
+            'record_id': job['record_id'],
+            'update_type': job['update_type']
+        }
+        if job['status'] == 'done':
+            view.update(job['result'])
+        elif job['status'] == 'failed':
+            view['error'] = job['error']
+        return view
+
+    def submit(self, weather_data, last_update_weather_data=None, previous_weather_data=None,
+               record_id=None, force_update=False):
+        """
+        提交建议任务；相同的进行中任务直接返回已有任务
+        :return: 任务状态字典（含 deduplicated 标记）
+        :raises queue.Full: 等待队列已满
+        """
+        key = self._job_key(weather_data, record_id, force_update)
+        with self._lock:
+            self._ensure_started()
+            self._purge_expired()
+            job_id = self._inflight.get(key)
+            if job_id:
+                return {**self._public_view(self._jobs[job_id]), 'deduplicated': True}
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'status': 'queued',
+                'record_id': record_id,
+                'update_type': 'forced' if force_update else 'auto',
+                'args': (weather_data, last_update_weather_data, previous_weather_data, force_update),
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'finished_at': None,
+                'done': threading.Event()
+            }
+            self._queue.put_nowait(job)
+            self._jobs[job['id']] = job
+            self._inflight[key] = job['id']
+            return {**self._public_view(job), 'deduplicated': False}
+
+    def get(self, job_id, wait=0):
+        """
+        查询任务状态，可选短暂等待任务完成
+        :param job_id: 任务ID
+        :param wait: 最长等待秒数，0表示立即返回
+        :return: 任务状态字典，任务不存在返回None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if not job:
+            return None
+        if wait > 0:
+            job['done'].wait(wait)
+        with self._lock:
+            return self._public_view(job)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job['status'] = 'running'
+            try:
+                ai_result = get_ai_advice(*job['args'])
+                advice = ai_result.get('advice')
+                if job['record_id'] and should_save_advice(ai_result):
+                    save_advice_record(job['record_id'], advice, update_type=job['update_type'])
+                result, error, status = {
+                    'advice': advice,
+                    'need_update': ai_result.get('need_update', True),
+                    'stages': ai_result.get('stages', [])
+                }, None, 'done'
+            except Exception as e:
+                print(f"[建议任务] 任务 {job['id']} 执行失败: {e}")
+                result, error, status = None, f'生成建议失败: {str(e)}', 'failed'
+            with self._lock:
+                job['result'] = result
+                job['error'] = error
+                job['status'] = status
+                job['finished_at'] = time.time()
+                job['args'] = None  # 释放天气数据
+                if self._inflight.get(job['key']) == job['id']:
+                    del self._inflight[job['key']]
+            job['done'].set()
+            self._queue.task_done()
+
+# 全局任务管理器
+advice_jobs = AdviceJobManager(
+    workers=AdviceJobConfig.WORKERS,
+    queue_size=AdviceJobConfig.QUEUE_SIZE,
+    result_ttl=AdviceJobConfig.RESULT_TTL
+)
+
+def submit_advice_job(weather_data, last_update_weather_data=None, previous_weather_data=None,
+                      record_id=None, force_update=False):
+    """
+    提交AI建议后台任务
+    :return: 任务状态字典，队列已满时返回None
+    """
+    try:
+        return advice_jobs.submit(weather_data, last_update_weather_data, previous_weather_data,
+                                  record_id, force_update)
+    except queue.Full:
+        return None
+
+def get_advice_job(job_id, wait=0):
+    """
+    查询AI建议后台任务状态
+    :param job_id: 任务ID
+    :param wait: 最长等待秒数（不超过配置的上限）
+    :return: 任务状态字典，任务不存在返回None
+    """
+    return advice_jobs.get(job_id, min(max(wait, 0), AdviceJobConfig.MAX_WAIT))
@@ -2,8 +2,23 @@
 
 import requests  # 用于发送HTTP请求
 import json
-from config import DeepSeekConfig  # 导入DeepSeek配置
-from core.weather import get_weather_alerts  # 导入天气相关函数
+import time  # 用于记录各阶段耗时
+from config import DeepSeekConfig, AdviceIndexConfig  # 导入DeepSeek配置和相似天气索引配置
+from core.weather import get_weather_alerts, get_alert_key  # 导入天气相关函数
+from core.advice_index import advice_index, extract_features, feature_distance, fill_location_details  # 相似天气建议索引
+
+# 无法生成建议时返回给前端的提示文本（不是真正的建议，不应保存或加入索引）
+NO_WEATHER_TEXT = "无法获取天气数据，请检查网络连接或API配置"
+ADVICE_FAILURE_TEXT = "抱歉，暂时无法生成建议。请稍后再试。"
+ADVICE_FAILURE_TEXTS = (NO_WEATHER_TEXT, ADVICE_FAILURE_TEXT)
+
+def should_save_advice(ai_result):
+    """
+    判断 get_ai_advice 的结果是否应保存为建议记录：只有确实需要更新且为真实建议时才保存，
+    避免失败提示成为“上次建议”的比较基准
+    """
+    advice = ai_result.get('advice')
+    return bool(ai_result.get('need_update') and advice and advice not in ADVICE_FAILURE_TEXTS)
 
 def extract_brief_current(weather):
     """
@@ -25,21 +40,184 @@ def extract_brief_current(weather):
         "lon": weather.get("lon")
     }
 
+def get_alert_keys(weather):
+    """
+    提取天气数据中生效预警的唯一标识集合（忽略格式异常的预警）
+    """
+    return {get_alert_key(alert) for alert in (weather or {}).get('alerts') or [] if isinstance(alert, dict)}
+
+def get_indexed_advice(current_weather_data, last_update_weather_data=None, force_update=False):
+    """
+    尝试用相似天气建议索引回答，无需调用大模型
+    - 自动模式下，当前天气与上次更新时足够接近且预警完全相同，直接判定不需要更新
+    - 否则在预警相同的历史建议中查找足够相似的天气，补充当前位置信息后复用
+    :return: 与 get_ai_advice 相同格式的字典，未命中返回None
+    """
+    if not AdviceIndexConfig.ENABLED or (force_update and not AdviceIndexConfig.USE_FOR_FORCED):
+        return None
+
+    if not force_update and last_update_weather_data and \
+            get_alert_keys(current_weather_data) == get_alert_keys(last_update_weather_data):
+        # 预警有任何变化（新增、解除或换了一条）都不能直接判定无需更新
+        current_features = extract_features(current_weather_data)
+        last_features = extract_features(last_update_weather_data)
+        if current_features is not None and last_features is not None and \
+                feature_distance(current_features, last_features) <= AdviceIndexConfig.MAX_DISTANCE:
+            return {"advice": "", "need_update": False}
+
+    match = advice_index.search(current_weather_data, AdviceIndexConfig.MAX_DISTANCE)
+    if match:
+        return {"advice": fill_location_details(match['advice'], current_weather_data), "need_update": True}
+    return None
+
+def extract_change_snapshot(weather):
+    """
+    提取判断天气是否显著变化所需的最少字段（供第一阶段分类调用，控制token消耗）
+    """
+    if not weather or 'current' not in weather:
+        return {}
+    current = weather['current']
+    weather_desc = current.get('weather') or [{}]
+    return {
+        "temp": current.get('temp'),
+        "feels_like": current.get('feels_like'),
+        "humidity": current.get('humidity'),
+        "wind_speed": current.get('wind_speed'),
+        "rain_1h": (current.get('rain') or {}).get('1h', 0),
+        "snow_1h": (current.get('snow') or {}).get('1h', 0),
+        "weather": weather_desc[0].get('description'),
+        "alerts": [alert.get('event') for alert in weather.get('alerts') or []]
+    }
+
+def call_deepseek(stage, model, system_prompt, user_message, json_mode=False, max_tokens=None):
+    """
+    调用DeepSeek对话接口，并记录该阶段的耗时和token用量
+    :param stage: 阶段名称（'classify' 或 'generate'），用于日志和统计
+    :param model: 模型名称
+    :param system_prompt: 系统提示词
+    :param user_message: 用户消息
+    :param json_mode: 是否要求返回JSON格式
+    :param max_tokens: 最大输出token数（可选）
+    :return: (回复文本, 阶段统计字典)，请求失败时回复文本为None
+    """
+    # 使用requests直接调用DeepSeek API
+    headers = {
+        "Authorization": f"Bearer {DeepSeekConfig.API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    data = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ],
+        "stream": False
+    }
+    if json_mode:
+        data["response_format"] = {"type": "json_object"}
+    if max_tokens:
+        data["max_tokens"] = max_tokens
+
+    # 发送POST请求到DeepSeek API
+    started = time.perf_counter()
+    response = requests.post(
+        f"{DeepSeekConfig.API_URL}/chat/completions",
+        headers=headers,
+        json=data,
+        timeout=DeepSeekConfig.TIMEOUT
+    )
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    metrics = {
+        "stage": stage,
+        "model": model,
+        "latency_ms": latency_ms,
+        "prompt_tokens": None,
+        "completion_tokens": None
+    }
+
+    # 检查响应状态
+    if response.status_code != 200:
+        print(f"DeepSeek API请求失败（{stage}），状态码: {response.status_code}")
+        print(f"响应内容: {response.text}")
+        return None, metrics
+
+    response_data = response.json()
+    usage = response_data.get('usage') or {}
+    metrics["prompt_tokens"] = usage.get('prompt_tokens')
+    metrics["completion_tokens"] = usage.get('completion_tokens')
+    print(f"[AI建议] 阶段 {stage}: 模型 {model}, 耗时 {latency_ms}ms, "
+          f"输入 {metrics['prompt_tokens']} tokens, 输出 {metrics['completion_tokens']} tokens")
+    return response_data['choices'][0]['message']['content'], metrics
+
+def classify_need_update(current_weather_data, last_update_weather_data):
+    """
+    第一阶段：用精简上下文和较小的输出上限判断天气变化是否显著、是否需要更新建议
+    :return: (是否需要更新, 阶段统计字典)；调用或解析失败时默认需要更新
+    """
+    system_prompt = """你是一个天气变化判断器。比较当前天气与上次更新建议时的天气，
+    如相比之前温度变化显著、天气状况改变、有新的预警信息或者你觉得有任何更新建议的必要，则需要更新建议，否则不需要。
+    只输出JSON：{"need_update": true} 或 {"need_update": false}"""
+    user_message = (
+        f"当前天气：{json.dumps(extract_change_snapshot(current_weather_data), ensure_ascii=False)}\n"
+        f"上次更新时的天气：{json.dumps(extract_change_snapshot(last_update_weather_data), ensure_ascii=False)}"
+    )
+
+    ai_response, metrics = call_deepseek(
+        'classify',
+        DeepSeekConfig.CLASSIFIER_MODEL,
+        system_prompt,
+        user_message,
+        json_mode=True,
+        max_tokens=DeepSeekConfig.CLASSIFIER_MAX_TOKENS
+    )
+    if ai_response is None:
+        return True, metrics
+    try:
+        return bool(json.loads(ai_response).get("need_update", True)), metrics
+    except Exception as e:
+        # 如果JSON解析失败，默认需要更新
+        print(f"分类响应不是有效的JSON，默认需要更新建议: {e}")
+        return True, metrics
+
 def get_ai_advice(current_weather_data, last_update_weather_data=None, previous_weather_data=None, force_update=False):
-    # 在AI建议生成前排除 current.weather 字段，避免无用token消耗
-    if 'current' in current_weather_data and 'weather' in current_weather_data['current']:
-        del current_weather_data['current']['weather']
     """
     基于天气数据获取AI建议
+    自动更新时分两阶段：先用轻量分类调用判断是否需要更新，只有需要更新时才用完整提示词生成建议
     :param current_weather_data: 当前天气数据字典
+    :param last_update_weather_data: 上次更新建议时的天气数据字典（可选）
     :param previous_weather_data: 之前的天气数据字典（可选）
     :param force_update: 是否强制更新建议（“给我点建议”时使用）
-    :return: 字典包含建议文本和是否需要更新的标志
+    :return: 字典包含建议文本、是否需要更新的标志和各阶段统计（stages）
     """
     if not current_weather_data:
-        return {"advice": "无法获取天气数据，请检查网络连接或API配置", "need_update": False}
-    
+        return {"advice": NO_WEATHER_TEXT, "need_update": False}
+
+    # 先查询相似天气建议索引，命中时不再调用大模型（需在裁剪 current.weather 前进行，天气状况是特征之一）
+    indexed = get_indexed_advice(current_weather_data, last_update_weather_data, force_update)
+    if indexed:
+        return indexed
+    # 保留特征计算所需的字段，供生成建议后加入索引
+    index_weather_data = {
+        "current": dict(current_weather_data.get('current', {})),
+        "alerts": current_weather_data.get('alerts'),
+        "timezone": current_weather_data.get('timezone')
+    }
+
+    stages = []
     try:
+        # 第一阶段：自动更新且有上次更新的天气可比较时，先判断是否需要更新
+        if not force_update and last_update_weather_data:
+            need_update, metrics = classify_need_update(current_weather_data, last_update_weather_data)
+            stages.append(metrics)
+            if not need_update:
+                return {"advice": "", "need_update": False, "stages": stages}
+
+        # 在AI建议生成前排除 current.weather 字段，避免无用token消耗
+        if 'current' in current_weather_data and 'weather' in current_weather_data['current']:
+            del current_weather_data['current']['weather']
+
         # 规范 daily 字段，去除 sunrise、sunset、moonrise、moonset、moon_phase
         if 'daily' in current_weather_data:
             for day in current_weather_data['daily']:
@@ -59,22 +237,15 @@ def get_ai_advice(current_weather_data, last_update_weather_data=None, previous_
             5. 其他你认为需要给出的建议
             建议要具体、实用、简洁，适合普通用户的日常生活。"""
         else:
-            system_prompt = """你是一个专业的天气助手。目前在自动监控天气变化，请根据提供的天气数据，判断相比之前天气变化是否显著，是否需要更新建议。
-            如果当前天气相比以前的数据变化显著，则需要更新建议。
-            如果天气变化不显著，则不需要更新建议。
-            如果需要更新建议，请生成一份结构化的天气建议，建议内容包括：
+            system_prompt = """你是一个专业的天气助手。目前在自动监控天气变化，当前天气相比之前已发生显著变化，需要更新建议。
+            请根据提供的天气数据，生成一份结构化的天气建议，务必采用markdown格式规范回答保证美观，但不要用代码块（```）包裹，建议内容包括：
             1. 今日建议：针对当前天气给出实用建议。
             2. 未来几日提醒：如果有未来天气趋势，给出提醒。
-            3. 天气变化建议：因为你觉得天气变化显著，需要更新建议，所以请在此模块突出本次天气变化相关的建议。
+            3. 天气变化建议：因为天气变化显著，需要更新建议，所以请在此模块突出本次天气变化相关的建议。
             4. 安全建议：针对天气和预警给出安全方面的建议。
             5. 预警信息特别建议（只有有预警信息才需要）：如果有预警信息，请单独给出特别提醒。
             6. 其他你认为需要给出的建议
-            建议要具体、实用、简洁，适合普通用户的日常生活。
-            请按照以下JSON格式输出你的响应：
-            {
-            "need_update": true/false（如相比之前温度变化显著、天气状况改变、有新的预警信息或者你觉得有任何更新建议的必要则为true，否则为false）, 
-            "advice": "你的建议内容（务必采用markdown格式以保证美观，但不要用代码块（```）包裹，要包含完整的建议内容，结构化规范回答，"need_update": false时，此项留空）" 
-            }"""
+            建议要具体、实用、简洁，适合普通用户的日常生活。"""
 
         # 准备用户消息
         user_message = f"当前天气数据（完整）：\n{json.dumps(current_weather_data, indent=2)}"
@@ -83,63 +254,17 @@ def get_ai_advice(current_weather_data, last_update_weather_data=None, previous_
             brief_last_update = extract_brief_current(last_update_weather_data)
             user_message += f"\n\n上次更新时的天气数据（仅供参考）：\n{json.dumps(brief_last_update['current'], indent=2)}"
 
+        # 第二阶段：用完整提示词生成建议
+        ai_response, metrics = call_deepseek('generate', DeepSeekConfig.MODEL, system_prompt, user_message)
+        stages.append(metrics)
 
-        # 使用requests直接调用DeepSeek API
-        headers = {
-            "Authorization": f"Bearer {DeepSeekConfig.API_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        data = {
-            "model": DeepSeekConfig.MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            "stream": False
-        }
-
-        # 如果不是强制更新，要求返回JSON格式
-        if not force_update:
-            data["response_format"] = {"type": "json_object"}
-
-        # 发送POST请求到DeepSeek API
-        response = requests.post(
-            f"{DeepSeekConfig.API_URL}/chat/completions",
-            headers=headers,
-            json=data
-        )
-
-        # 检查响应状态
-        if response.status_code == 200:
-            response_data = response.json()
-            ai_response = response_data['choices'][0]['message']['content']
-
-            if force_update:
-                # 强制更新时，直接返回建议文本
-                return {"advice": ai_response, "need_update": True}
-            else:
-                # 非强制更新时，解析JSON响应
-                try:
-                    parsed_response = json.loads(ai_response)
-                    need_update = parsed_response.get("need_update", False)
-                    advice = parsed_response.get("advice", "")
-                    return {
-                        "advice": advice,
-                        "need_update": need_update
-                    }
-                except Exception as e:
-                    # 如果JSON解析失败，默认需要更新，且只返回建议内容（markdown）
-                    print(f"AI响应不是有效的JSON，默认需要更新建议: {e}")
-                    # 只返回建议内容，不返回整个JSON字符串
-                    return {"advice": ai_response, "need_update": True}
+        if ai_response is None:
+            return {"advice": ADVICE_FAILURE_TEXT, "need_update": False, "stages": stages}
 
-        else:
-            print(f"DeepSeek API请求失败，状态码: {response.status_code}")
-            print(f"响应内容: {response.text}")
-            return {"advice": "抱歉，暂时无法生成建议。请稍后再试。", "need_update": False}
+        advice_index.add(index_weather_data, ai_response)
+        return {"advice": ai_response, "need_update": True, "stages": stages}
 
     except Exception as e:
         # 处理可能的错误
         print(f"AI建议生成错误: {e}")
-        return {"advice": "抱歉，暂时无法生成建议。请稍后再试。", "need_update": False}
+        return {"advice": ADVICE_FAILURE_TEXT, "need_update": False, "stages": stages}
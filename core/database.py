@@ -2,6 +2,13 @@
 
 import sqlite3
 import json
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from config import DatabaseConfig  # 导入数据库配置
+from core.weather import get_alert_key, format_alert  # 预警标识与格式化
 
 # 初始化数据库，创建必要的表
 def init_db():
@@ -37,10 +44,45 @@ def init_db():
     )
     ''')
     
+    # 创建预警表：每条预警只写入一次，以 (发布单位, 事件, 开始, 结束) 的哈希为主键
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS weather_alerts (
+        id TEXT PRIMARY KEY,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        sender_name TEXT,
+        event TEXT,
+        start INTEGER,
+        end INTEGER,
+        alert_text TEXT NOT NULL,  -- 格式化后的展示文本
+        alert_data TEXT NOT NULL   -- 原始预警JSON
+    )
+    ''')
+
+    # 创建天气记录与预警的关联表：天气记录只引用当时生效的预警ID
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS weather_record_alerts (
+        weather_record_id INTEGER NOT NULL,
+        alert_id TEXT NOT NULL,
+        position INTEGER NOT NULL,  -- 预警在原始数据中的顺序
+        PRIMARY KEY (weather_record_id, alert_id),
+        FOREIGN KEY (weather_record_id) REFERENCES weather_records (id),
+        FOREIGN KEY (alert_id) REFERENCES weather_alerts (id)
+    )
+    ''')
+
+    # 创建ID预留表：后写模式下每个进程按块预留记录ID，保证入队时即可返回ID
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS id_reservations (
+        table_name TEXT PRIMARY KEY,
+        next_id INTEGER NOT NULL
+    )
+    ''')
+
     # 创建索引以提高查询性能
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_weather_location ON weather_records (latitude, longitude)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_weather_timestamp ON weather_records (timestamp)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_advice_weather_id ON advice_records (weather_record_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_record_alerts_alert ON weather_record_alerts (alert_id)')
     
     conn.commit()
     conn.close()
@@ -50,23 +92,37 @@ def init_db():
 def save_weather_record(lat, lon, weather_data, alerts, source='auto'):
     """
     保存一条天气记录到数据库
+    原始数据中的预警写入预警表（已存在则跳过），天气记录只保存预警ID引用
+    后写模式下只预留ID并放入写队列，由后台线程批量提交
     :param lat: 纬度
     :param lon: 经度
     :param weather_data: 天气数据（字典）
-    :param alerts: 预警信息（列表）
+    :param alerts: 预警信息（列表），仅在原始数据不含预警时按旧格式保存
     :param source: 来源（'auto'或'manual'）
     :return: 新记录的ID，失败返回None
     """
     try:
         if alerts is None:
             alerts = []
+        raw_alerts = (weather_data or {}).get('alerts') or []
+        # 预警单独存储，天气数据中不再重复保存
+        stored_data = {k: v for k, v in (weather_data or {}).items() if k != 'alerts'}
+        row = (lat, lon, json.dumps(stored_data), None if raw_alerts else json.dumps(alerts), source)
+
+        if DatabaseConfig.WRITE_BEHIND:
+            record_id = _reserve_id('weather_records')
+            # 入队前生成全部待写行（包括预警格式化），输入有问题时由调用方直接得到失败结果
+            _enqueue_write('weather', (record_id, _utc_now()) + row, _build_alert_rows(record_id, raw_alerts))
+            return record_id
+
         conn = sqlite3.connect('weather_ai.db')
         cursor = conn.cursor()
         cursor.execute('''
         INSERT INTO weather_records (latitude, longitude, weather_data, alerts, source)
         VALUES (?, ?, ?, ?, ?)
-        ''', (lat, lon, json.dumps(weather_data), json.dumps(alerts), source))
+        ''', row)
         record_id = cursor.lastrowid
+        _save_record_alerts(cursor, record_id, raw_alerts)
         conn.commit()
         conn.close()
         return record_id
@@ -74,62 +130,297 @@ def save_weather_record(lat, lon, weather_data, alerts, source='auto'):
         print(f"[数据库] 保存天气记录失败: {e}")
         return None
 
+def _build_alert_rows(record_id, raw_alerts):
+    """
+    生成预警表和关联表要写入的行（包括格式化预警文本）
+    :param record_id: 天气记录ID
+    :param raw_alerts: 原始预警列表
+    :return: (预警行列表, 关联行列表)
+    """
+    alert_rows = []
+    link_rows = []
+    for position, alert in enumerate(raw_alerts or []):
+        if not isinstance(alert, dict):
+            # 格式异常的预警直接跳过，不影响天气记录本身的保存
+            continue
+        alert_id = get_alert_key(alert)
+        alert_rows.append((alert_id, alert.get('sender_name'), alert.get('event'), alert.get('start'),
+                           alert.get('end'), format_alert(alert), json.dumps(alert)))
+        link_rows.append((record_id, alert_id, position))
+    return alert_rows, link_rows
+
+def _insert_alert_rows(cursor, alert_rows, link_rows):
+    """
+    写入预警（每条预警只写一次）并记录天气记录与预警的关联
+    :param cursor: 数据库游标
+    :param alert_rows: 预警行列表
+    :param link_rows: 关联行列表
+    """
+    if not alert_rows:
+        return
+    cursor.executemany('''
+    INSERT OR IGNORE INTO weather_alerts (id, sender_name, event, start, end, alert_text, alert_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', alert_rows)
+    cursor.executemany('''
+    INSERT OR IGNORE INTO weather_record_alerts (weather_record_id, alert_id, position)
+    VALUES (?, ?, ?)
+    ''', link_rows)
+
+def _save_record_alerts(cursor, record_id, raw_alerts):
+    """
+    写入天气记录引用的预警
+    :param cursor: 数据库游标
+    :param record_id: 天气记录ID
+    :param raw_alerts: 原始预警列表
+    """
+    _insert_alert_rows(cursor, *_build_alert_rows(record_id, raw_alerts))
+
+def _load_record_alerts(cursor, record_ids):
+    """
+    批量读取天气记录引用的预警
+    :param cursor: 数据库游标
+    :param record_ids: 天气记录ID列表
+    :return: 字典 {记录ID: (展示文本列表, 原始预警列表)}，无引用的记录不出现在结果中
+    """
+    if not record_ids:
+        return {}
+    placeholders = ','.join('?' * len(record_ids))
+    cursor.execute(f'''
+    SELECT r.weather_record_id, a.alert_text, a.alert_data
+    FROM weather_record_alerts r
+    JOIN weather_alerts a ON a.id = r.alert_id
+    WHERE r.weather_record_id IN ({placeholders})
+    ORDER BY r.weather_record_id, r.position
+    ''', list(record_ids))
+    linked = {}
+    for record_id, alert_text, alert_data in cursor.fetchall():
+        texts, raw = linked.setdefault(record_id, ([], []))
+        texts.append(alert_text)
+        raw.append(json.loads(alert_data))
+    return linked
+
+def _decode_alerts(weather_data, alerts_text, linked):
+    """
+    还原天气记录的预警：新记录从预警表还原（同时补回天气数据中的 alerts），旧记录直接读取 alerts 字段
+    :param weather_data: 已解析的天气数据字典（会被原地补充 alerts）
+    :param alerts_text: weather_records.alerts 字段内容
+    :param linked: _load_record_alerts 返回的该记录对应项，可为None
+    :return: 预警展示文本列表
+    """
+    if linked:
+        texts, raw = linked
+        weather_data['alerts'] = raw
+        return texts
+    return json.loads(alerts_text) if alerts_text else []
+
 # 保存建议记录
 def save_advice_record(weather_record_id, advice_text, update_type='forced'):
     """
-    保存一条建议记录到数据库
+    保存一条建议记录到数据库（后写模式下放入写队列）
     :param weather_record_id: 对应天气记录ID
     :param advice_text: 建议内容
     :param update_type: 更新类型（'forced'或'auto'）
+    :return: 新记录的ID，失败返回None
     """
     try:
+        row = (weather_record_id, advice_text, update_type)
+
+        if DatabaseConfig.WRITE_BEHIND:
+            advice_id = _reserve_id('advice_records')
+            _enqueue_write('advice', (advice_id, _utc_now()) + row, None)
+            return advice_id
+
         conn = sqlite3.connect('weather_ai.db')
         cursor = conn.cursor()
         cursor.execute('''
         INSERT INTO advice_records (weather_record_id, advice_text, update_type)
         VALUES (?, ?, ?)
-        ''', (weather_record_id, advice_text, update_type))
+        ''', row)
+        advice_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        return advice_id
     except Exception as e:
         print(f"[数据库] 保存建议记录失败: {e}")
+        return None
 
-# 获取指定位置的最新天气记录
-def get_last_weather_record(lat, lon):
+# ---------------- 后写模式（write-behind） ----------------
+# 开启 DatabaseConfig.WRITE_BEHIND 后，保存操作只预留ID并入队，后台线程按数量/时间批量提交，
+# 请求延迟不再受磁盘同步影响。ID按块从 id_reservations 表预留，多进程部署时各进程的ID互不冲突，
+# 但ID不再随时间递增，查询“最新”记录时需按 timestamp 排序而不是按ID；
+# 同一数据库的所有进程需使用相同的写入模式，否则自增ID可能与已预留的ID冲突。
+
+_write_queue = queue.Queue()
+_pending_weather = {}  # 已入队但尚未落盘的天气记录：记录ID -> (行数据, (预警行, 关联行))，供按ID读取
+_pending_lock = threading.Lock()
+_writer_thread = None
+_writer_lock = threading.Lock()
+_id_blocks = {}  # 表名 -> [下一个可用ID, 预留块结束ID（不含）]
+_id_lock = threading.Lock()
+
+def _utc_now():
+    # 与 CURRENT_TIMESTAMP 相同的UTC格式，记录入队时刻而不是落盘时刻
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+def _reserve_id_block(table, size):
     """
-    获取指定位置的最新天气记录
-    :param lat: 纬度
-    :param lon: 经度
-    :return: 天气记录字典，如果没有记录返回None
+    在数据库中原子地预留一段连续ID
+    :param table: 表名（'weather_records' 或 'advice_records'）
+    :param size: 预留数量
+    :return: [起始ID, 结束ID（不含）]
     """
+    conn = sqlite3.connect('weather_ai.db', isolation_level=None)
     try:
-        conn = sqlite3.connect('weather_ai.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-        SELECT id, timestamp, weather_data, alerts, source
-        FROM weather_records
-        WHERE latitude = ? AND longitude = ?
-        ORDER BY timestamp DESC
-        LIMIT 1
-        ''', (lat, lon))
-        record = cursor.fetchone()
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT next_id FROM id_reservations WHERE table_name = ?', (table,)).fetchone()
+        max_id = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+        start = max(row[0] if row else 1, max_id + 1)
+        conn.execute('INSERT OR REPLACE INTO id_reservations (table_name, next_id) VALUES (?, ?)', (table, start + size))
+        conn.execute('COMMIT')
+        return [start, start + size]
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
         conn.close()
-        if record:
-            return {
-                'id': record[0],
-                'timestamp': record[1],
-                'weather_data': json.loads(record[2]),
-                'alerts': json.loads(record[3]),
-                'source': record[4]
-            }
-        else:
-            return None
-    except Exception as e:
-        print(f"[数据库] 查询最新天气记录失败: {e}")
+
+def _reserve_id(table):
+    # 从本进程已预留的ID块中取一个，用完后再预留下一块
+    with _id_lock:
+        block = _id_blocks.get(table)
+        if not block or block[0] >= block[1]:
+            block = _id_blocks[table] = _reserve_id_block(table, DatabaseConfig.ID_BLOCK_SIZE)
+        record_id = block[0]
+        block[0] += 1
+        return record_id
+
+def _enqueue_write(kind, row, alert_rows):
+    # 放入写队列，首次使用时启动写线程
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name='db-writer', daemon=True)
+            _writer_thread.start()
+            atexit.register(shutdown_write_behind)
+    if kind == 'weather':
+        with _pending_lock:
+            _pending_weather[row[0]] = (row, alert_rows)
+    _write_queue.put((kind, row, alert_rows))
+
+def _get_pending_weather_record(record_id):
+    """
+    从写队列中读取尚未落盘的天气记录（格式与数据库读取结果相同）
+    :param record_id: 天气记录ID
+    :return: 天气记录字典，不在写队列中时返回None
+    """
+    with _pending_lock:
+        pending = _pending_weather.get(record_id)
+    if not pending:
         return None
+    row, (alert_rows, _) = pending
+    weather_data = json.loads(row[4])
+    if alert_rows:
+        weather_data['alerts'] = [json.loads(alert_row[6]) for alert_row in alert_rows]
+        alerts = [alert_row[5] for alert_row in alert_rows]
+    else:
+        alerts = json.loads(row[5]) if row[5] else []
+    return {
+        'id': row[0],
+        'timestamp': row[1],
+        'weather_data': weather_data,
+        'alerts': alerts,
+        'source': row[6]
+    }
 
-# 获取指定位置的最新建议记录
+def _write_items(cursor, items):
+    """
+    写入一组待写记录（天气记录先于建议记录写入）
+    :param cursor: 数据库游标
+    :param items: 待写记录列表 [(类型, 行数据, (预警行, 关联行) 或 None)]
+    """
+    cursor.executemany('''
+    INSERT INTO weather_records (id, timestamp, latitude, longitude, weather_data, alerts, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [row for kind, row, _ in items if kind == 'weather'])
+    for kind, row, alert_rows in items:
+        if kind == 'weather':
+            _insert_alert_rows(cursor, *alert_rows)
+    cursor.executemany('''
+    INSERT INTO advice_records (id, timestamp, weather_record_id, advice_text, update_type)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [row for kind, row, _ in items if kind == 'advice'])
 
+def _flush_batch(batch):
+    """
+    在一个事务中批量提交一组待写记录；批量失败时回滚并逐条重试，避免一条坏数据拖累整批
+    :param batch: 待写记录列表
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect('weather_ai.db')
+        try:
+            _write_items(conn.cursor(), batch)
+            conn.commit()
+            return
+        except Exception as e:
+            conn.rollback()
+            print(f"[数据库] 批量写入失败，改为逐条写入（共 {len(batch)} 条）: {e}")
+        for item in batch:
+            try:
+                _write_items(conn.cursor(), [item])
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                label = '天气' if item[0] == 'weather' else '建议'
+                print(f"[数据库] 写入{label}记录 {item[1][0]} 失败: {e}")
+    except Exception as e:
+        print(f"[数据库] 批量写入失败（{len(batch)} 条记录未写入）: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _writer_loop():
+    # 取到第一条后，在 FLUSH_INTERVAL 内继续收集，最多 BATCH_SIZE 条一起提交
+    stopping = False
+    while not stopping:
+        item = _write_queue.get()
+        if item is None:
+            break
+        batch = [item]
+        deadline = time.monotonic() + DatabaseConfig.FLUSH_INTERVAL
+        while len(batch) < DatabaseConfig.BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = _write_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+        _flush_batch(batch)
+        # 落盘后（无论成功与否）从待写记录中移除，之后按ID读取走数据库
+        with _pending_lock:
+            for kind, row, _ in batch:
+                if kind == 'weather':
+                    _pending_weather.pop(row[0], None)
+
+def shutdown_write_behind():
+    """
+    停止写线程：写完队列中剩余的记录后退出（进程退出时自动调用）
+    """
+    global _writer_thread
+    with _writer_lock:
+        thread = _writer_thread
+        _writer_thread = None
+    if thread is not None and thread.is_alive():
+        _write_queue.put(None)
+        thread.join()
+
+# 获取指定位置的最新天气记录
 def get_last_weather_record(lat, lon, exclude_id=None):
     """
     获取指定位置的最新天气记录（可选排除某条记录）
@@ -145,8 +436,8 @@ def get_last_weather_record(lat, lon, exclude_id=None):
             cursor.execute('''
             SELECT id, timestamp, weather_data, alerts, source
             FROM weather_records
-            WHERE latitude = ? AND longitude = ? AND id < ?
-            ORDER BY timestamp DESC
+            WHERE latitude = ? AND longitude = ? AND id != ?
+            ORDER BY timestamp DESC, id DESC
             LIMIT 1
             ''', (lat, lon, exclude_id))
         else:
@@ -154,25 +445,105 @@ def get_last_weather_record(lat, lon, exclude_id=None):
             SELECT id, timestamp, weather_data, alerts, source
             FROM weather_records
             WHERE latitude = ? AND longitude = ?
-            ORDER BY timestamp DESC
+            ORDER BY timestamp DESC, id DESC
             LIMIT 1
             ''', (lat, lon))
         record = cursor.fetchone()
-        conn.close()
         if record:
+            linked = _load_record_alerts(cursor, [record[0]])
+            conn.close()
+            weather_data = json.loads(record[2])
             return {
                 'id': record[0],
                 'timestamp': record[1],
-                'weather_data': json.loads(record[2]),
-                'alerts': json.loads(record[3]),
+                'weather_data': weather_data,
+                'alerts': _decode_alerts(weather_data, record[3], linked.get(record[0])),
                 'source': record[4]
             }
         else:
+            conn.close()
             return None
     except Exception as e:
         print(f"[数据库] 查询最新天气记录失败: {e}")
         return None
 
+# 按ID获取天气记录
+def get_weather_record(record_id):
+    """
+    按ID获取一条天气记录（后写模式下也能读到仍在写队列中的记录）
+    :param record_id: 天气记录ID
+    :return: 天气记录字典，如果没有记录返回None
+    """
+    # 先查写队列再查数据库：写线程在落盘之后才移除待写记录，不会出现两边都查不到的间隙
+    pending = _get_pending_weather_record(record_id)
+    if pending:
+        return pending
+    try:
+        conn = sqlite3.connect('weather_ai.db')
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT id, timestamp, weather_data, alerts, source
+        FROM weather_records
+        WHERE id = ?
+        ''', (record_id,))
+        record = cursor.fetchone()
+        if record:
+            linked = _load_record_alerts(cursor, [record[0]])
+            conn.close()
+            weather_data = json.loads(record[2])
+            return {
+                'id': record[0],
+                'timestamp': record[1],
+                'weather_data': weather_data,
+                'alerts': _decode_alerts(weather_data, record[3], linked.get(record[0])),
+                'source': record[4]
+            }
+        else:
+            conn.close()
+            return None
+    except Exception as e:
+        print(f"[数据库] 查询天气记录失败: {e}")
+        return None
+
+# 获取指定位置最近一次生成过建议的天气记录
+def get_last_advised_weather_record(lat, lon):
+    """
+    获取指定位置最近一次生成建议时对应的天气记录（用于服务端判断建议是否需要更新）
+    :param lat: 纬度
+    :param lon: 经度
+    :return: 天气记录字典（附带 advice_id），如果没有记录返回None
+    """
+    try:
+        conn = sqlite3.connect('weather_ai.db')
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT w.id, w.timestamp, w.weather_data, w.alerts, w.source, a.id
+        FROM advice_records a
+        JOIN weather_records w ON a.weather_record_id = w.id
+        WHERE w.latitude = ? AND w.longitude = ?
+        ORDER BY a.timestamp DESC, a.id DESC
+        LIMIT 1
+        ''', (lat, lon))
+        record = cursor.fetchone()
+        if record:
+            linked = _load_record_alerts(cursor, [record[0]])
+            conn.close()
+            weather_data = json.loads(record[2])
+            return {
+                'id': record[0],
+                'timestamp': record[1],
+                'weather_data': weather_data,
+                'alerts': _decode_alerts(weather_data, record[3], linked.get(record[0])),
+                'source': record[4],
+                'advice_id': record[5]
+            }
+        else:
+            conn.close()
+            return None
+    except Exception as e:
+        print(f"[数据库] 查询最近建议对应的天气记录失败: {e}")
+        return None
+
 # 获取指定位置的天气历史记录
 def get_weather_history(lat, lon, limit=10):
     """
@@ -195,10 +566,12 @@ def get_weather_history(lat, lon, limit=10):
         LIMIT ?
         ''', (lat, lon, limit))
         records = cursor.fetchall()
+        linked = _load_record_alerts(cursor, [record[0] for record in records])
         conn.close()
         history = []
         for record in records:
             weather_data = json.loads(record[4])
+            alerts = _decode_alerts(weather_data, record[5], linked.get(record[0]))
             tz_name = weather_data.get('timezone', 'Asia/Shanghai')
             try:
                 tz = pytz.timezone(tz_name)
@@ -218,7 +591,7 @@ def get_weather_history(lat, lon, limit=10):
                 'latitude': record[2],
                 'longitude': record[3],
                 'weather_data': weather_data,
-                'alerts': json.loads(record[5]),
+                'alerts': alerts,
                 'source': record[6],
                 'timezone': tz_name
             })
@@ -283,14 +656,16 @@ def get_recent_weather_records(lat, lon, hours=24):
         ORDER BY timestamp DESC
         ''', (lat, lon, f'-{hours} hours'))
         records = cursor.fetchall()
+        linked = _load_record_alerts(cursor, [record[0] for record in records])
         conn.close()
         recent_records = []
         for record in records:
+            weather_data = json.loads(record[2])
             recent_records.append({
                 'id': record[0],
                 'timestamp': record[1],
-                'weather_data': json.loads(record[2]),
-                'alerts': json.loads(record[3]),
+                'weather_data': weather_data,
+                'alerts': _decode_alerts(weather_data, record[3], linked.get(record[0])),
                 'source': record[4]
             })
         return recent_records
@@ -298,5 +673,203 @@ def get_recent_weather_records(lat, lon, hours=24):
         print(f"[数据库] 查询最近天气记录失败: {e}")
         return []
 
+# 分批迭代指定位置的天气记录（用于大批量导出）
+def iter_weather_records(lat, lon, start=None, end=None, chunk_size=500):
+    """
+    按时间顺序分批迭代指定位置的天气记录，每次只从游标读取 chunk_size 行，内存占用与总记录数无关
+    :param lat: 纬度
+    :param lon: 经度
+    :param start: 起始时间（UTC，'YYYY-MM-DD HH:MM:SS'，可选，包含）
+    :param end: 结束时间（UTC，'YYYY-MM-DD HH:MM:SS'，可选，包含）
+    :param chunk_size: 每批读取的行数
+    :return: 生成器，逐条产出天气记录字典
+    """
+    conn = sqlite3.connect('weather_ai.db')
+    try:
+        cursor = conn.cursor()
+        alert_cursor = conn.cursor()  # 预警查询使用独立游标，避免打断主查询
+        sql = '''
+        SELECT id, timestamp, latitude, longitude, weather_data, alerts, source
+        FROM weather_records
+        WHERE latitude = ? AND longitude = ?
+        '''
+        params = [lat, lon]
+        if start:
+            sql += ' AND timestamp >= ?'
+            params.append(start)
+        if end:
+            sql += ' AND timestamp <= ?'
+            params.append(end)
+        sql += ' ORDER BY timestamp, id'
+        cursor.execute(sql, params)
+        while True:
+            records = cursor.fetchmany(chunk_size)
+            if not records:
+                break
+            linked = _load_record_alerts(alert_cursor, [record[0] for record in records])
+            for record in records:
+                weather_data = json.loads(record[4])
+                yield {
+                    'id': record[0],
+                    'timestamp': record[1],
+                    'latitude': record[2],
+                    'longitude': record[3],
+                    'weather_data': weather_data,
+                    'alerts': _decode_alerts(weather_data, record[5], linked.get(record[0])),
+                    'source': record[6],
+                    'timezone': weather_data.get('timezone')
+                }
+    finally:
+        conn.close()
+
+# 分批迭代最近的建议记录及其对应的天气数据（用于构建相似天气建议索引）
+def iter_advice_with_weather(limit=5000, chunk_size=500, exclude_texts=()):
+    """
+    分批迭代最近的 limit 条建议记录（按时间从旧到新），并附带生成建议时的天气数据
+    :param limit: 最多返回的记录数
+    :param chunk_size: 每批读取的行数
+    :param exclude_texts: 需要排除的建议文本（如生成失败时的提示）
+    :return: 生成器，逐条产出字典 {'advice_id', 'advice_text', 'weather_record_id', 'latitude', 'longitude', 'weather_data'}
+    """
+    conn = sqlite3.connect('weather_ai.db')
+    try:
+        cursor = conn.cursor()
+        alert_cursor = conn.cursor()
+        exclude_texts = list(exclude_texts)
+        exclude_sql = ''
+        if exclude_texts:
+            exclude_sql = f"WHERE a.advice_text NOT IN ({','.join('?' * len(exclude_texts))})"
+        # 先取最新的 limit 条，再按时间正序输出，保证调用方按从旧到新的顺序追加
+        cursor.execute(f'''
+        SELECT * FROM (
+            SELECT a.id AS advice_id, a.timestamp AS advice_time, a.advice_text,
+                   w.id, w.latitude, w.longitude, w.weather_data, w.alerts
+            FROM advice_records a
+            JOIN weather_records w ON a.weather_record_id = w.id
+            {exclude_sql}
+            ORDER BY a.timestamp DESC, a.id DESC
+            LIMIT ?
+        )
+        ORDER BY advice_time ASC, advice_id ASC
+        ''', exclude_texts + [limit])
+        while True:
+            records = cursor.fetchmany(chunk_size)
+            if not records:
+                break
+            linked = _load_record_alerts(alert_cursor, list({record[3] for record in records}))
+            for record in records:
+                weather_data = json.loads(record[6])
+                _decode_alerts(weather_data, record[7], linked.get(record[3]))
+                yield {
+                    'advice_id': record[0],
+                    'advice_text': record[2],
+                    'weather_record_id': record[3],
+                    'latitude': record[4],
+                    'longitude': record[5],
+                    'weather_data': weather_data
+                }
+    finally:
+        conn.close()
+
+# 获取两条天气记录之间的预警变化
+def get_alert_changes(since_record_id, record_id=None, current_alerts=None):
+    """
+    获取相对某条天气记录新增和已解除的预警（基于预警ID的索引查询，不比较预警文本）
+    :param since_record_id: 作为比较基准的天气记录ID
+    :param record_id: 要比较的天气记录ID，缺省时使用与基准记录同一位置的最新记录
+    :param current_alerts: 要比较记录的原始预警列表（可选）；提供时直接按预警ID比较，
+                           无需该记录已落盘（后写模式下刚保存的记录可能还在写队列中）
+    :return: 字典 {'record_id', 'since_record_id', 'new', 'expired', 'changed'}，失败返回None
+    """
+    try:
+        conn = sqlite3.connect('weather_ai.db')
+        cursor = conn.cursor()
+        if current_alerts is not None:
+            cursor.execute('''
+            SELECT a.id, a.event, a.sender_name, a.start, a.end, a.alert_text
+            FROM weather_record_alerts r
+            JOIN weather_alerts a ON a.id = r.alert_id
+            WHERE r.weather_record_id = ?
+            ORDER BY r.position
+            ''', (since_record_id,))
+            since_alerts = [{
+                'id': row[0],
+                'event': row[1],
+                'sender_name': row[2],
+                'start': row[3],
+                'end': row[4],
+                'text': row[5]
+            } for row in cursor.fetchall()]
+            conn.close()
+            # 与保存时使用同样的行构建逻辑，格式异常的预警同样跳过
+            alert_rows, _ = _build_alert_rows(record_id, current_alerts)
+            current = [{
+                'id': row[0],
+                'event': row[2],
+                'sender_name': row[1],
+                'start': row[3],
+                'end': row[4],
+                'text': row[5]
+            } for row in alert_rows]
+            since_ids = {alert['id'] for alert in since_alerts}
+            current_ids = {alert['id'] for alert in current}
+            new_alerts = [alert for alert in current if alert['id'] not in since_ids]
+            expired_alerts = [alert for alert in since_alerts if alert['id'] not in current_ids]
+            return {
+                'record_id': record_id,
+                'since_record_id': since_record_id,
+                'new': new_alerts,
+                'expired': expired_alerts,
+                'changed': bool(new_alerts or expired_alerts)
+            }
+
+        if record_id is None:
+            cursor.execute('''
+            SELECT w.id
+            FROM weather_records w
+            JOIN weather_records s ON s.latitude = w.latitude AND s.longitude = w.longitude
+            WHERE s.id = ?
+            ORDER BY w.timestamp DESC, w.id DESC
+            LIMIT 1
+            ''', (since_record_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.close()
+                return None
+            record_id = row[0]
+
+        def query_difference(left_id, right_id):
+            # left 中存在而 right 中不存在的预警
+            cursor.execute('''
+            SELECT a.id, a.event, a.sender_name, a.start, a.end, a.alert_text
+            FROM weather_record_alerts r
+            JOIN weather_alerts a ON a.id = r.alert_id
+            WHERE r.weather_record_id = ?
+            AND r.alert_id NOT IN (SELECT alert_id FROM weather_record_alerts WHERE weather_record_id = ?)
+            ORDER BY r.position
+            ''', (left_id, right_id))
+            return [{
+                'id': row[0],
+                'event': row[1],
+                'sender_name': row[2],
+                'start': row[3],
+                'end': row[4],
+                'text': row[5]
+            } for row in cursor.fetchall()]
+
+        new_alerts = query_difference(record_id, since_record_id)
+        expired_alerts = query_difference(since_record_id, record_id)
+        conn.close()
+        return {
+            'record_id': record_id,
+            'since_record_id': since_record_id,
+            'new': new_alerts,
+            'expired': expired_alerts,
+            'changed': bool(new_alerts or expired_alerts)
+        }
+    except Exception as e:
+        print(f"[数据库] 查询预警变化失败: {e}")
+        return None
+
 # 初始化数据库（应用启动时自动执行）
 init_db()
\ No newline at end of file
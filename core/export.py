@@ -0,0 +1,104 @@
+# 历史数据导出模块：将天气记录以 NDJSON 或 CSV 流式输出，支持字段投影
+
+import csv
+import io
+import json
+
+# 支持的导出格式及对应的MIME类型
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# 未指定字段时默认导出的字段
+DEFAULT_FIELDS = ['id', 'timestamp', 'latitude', 'longitude', 'source', 'timezone', 'alerts', 'weather_data']
+
+def parse_fields(fields):
+    """
+    解析字段投影参数
+    :param fields: 逗号分隔的字符串或字段列表，支持点号路径（如 current.temp 表示天气数据中的字段）
+    :return: 字段列表
+    """
+    if not fields:
+        return list(DEFAULT_FIELDS)
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return [field.strip() for field in fields if field and field.strip()]
+
+def project_record(record, fields):
+    """
+    按字段列表从天气记录中取值
+    顶层字段直接读取记录，其余点号路径从 weather_data 中逐级读取，缺失时为None
+    :param record: 天气记录字典
+    :param fields: 字段列表
+    :return: 投影后的字典（保持字段顺序）
+    """
+    projected = {}
+    for field in fields:
+        if field in record:
+            projected[field] = record[field]
+            continue
+        value = record.get('weather_data')
+        for key in field.split('.'):
+            if isinstance(value, dict):
+                value = value.get(key)
+            elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                value = value[int(key)]
+            else:
+                value = None
+                break
+        projected[field] = value
+    return projected
+
+def iter_ndjson(records, fields):
+    """
+    逐行产出 NDJSON
+    :param records: 天气记录可迭代对象（通常为生成器）
+    :param fields: 字段列表
+    :return: 生成器，每次产出一行JSON文本
+    """
+    for record in records:
+        yield json.dumps(project_record(record, fields), ensure_ascii=False) + '\n'
+
+def iter_csv(records, fields):
+    """
+    逐行产出 CSV（首行为表头），嵌套的字典/列表以JSON文本写入单元格
+    :param records: 天气记录可迭代对象（通常为生成器）
+    :param fields: 字段列表
+    :return: 生成器，每次产出一行CSV文本
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush_row(row):
+        writer.writerow(row)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    yield flush_row(fields)
+    for record in records:
+        projected = project_record(record, fields)
+        row = []
+        for field in fields:
+            value = projected[field]
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            row.append(value)
+        yield flush_row(row)
+
+def iter_export(records, export_format='ndjson', fields=None):
+    """
+    按指定格式流式导出天气记录
+    :param records: 天气记录可迭代对象
+    :param export_format: 'ndjson' 或 'csv'
+    :param fields: 字段投影（字符串或列表，可选）
+    :return: 生成器，逐行产出导出文本
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}")
+    fields = parse_fields(fields)
+    if export_format == 'csv':
+        return iter_csv(records, fields)
+    return iter_ndjson(records, fields)
@@ -3,6 +3,27 @@
 import requests  # 用于发送HTTP请求
 from config import WeatherConfig  # 导入天气配置
 from datetime import datetime  # 用于时间处理
+import hashlib  # 用于计算预警唯一标识
+
+# 已格式化预警文本的缓存（预警标识 -> 展示文本）
+ALERT_CACHE_SIZE = 256
+_formatted_alert_cache = {}
+
+# 天气数据投影预设：字段路径用点号分隔，遇到列表时对每个元素应用剩余路径；None表示完整数据
+WEATHER_VIEWS = {
+    # 页面天气卡片（updateWeatherDisplay）用到的字段
+    'current': [
+        'timezone',
+        'current.temp', 'current.feels_like', 'current.humidity', 'current.pressure', 'current.wind_speed',
+        'current.weather.description', 'current.weather.icon'
+    ],
+    # 当前天气完整字段 + 每日预报摘要
+    'summary': [
+        'lat', 'lon', 'timezone', 'timezone_offset', 'current', 'alerts',
+        'daily.dt', 'daily.summary', 'daily.temp', 'daily.weather', 'daily.pop'
+    ],
+    'full': None
+}
 
 def get_weather_data(lat, lon):
     """
@@ -45,6 +66,74 @@ def get_weather_data(lat, lon):
         print(f"JSON解析错误: {e}")
         return None
 
+_MISSING = object()
+
+def _project_value(value, path):
+    # 按路径取值并保留外层的嵌套结构；列表逐元素投影（缺失的元素保留为空字典以保持下标对齐）
+    if not path:
+        return value
+    if isinstance(value, list):
+        items = [_project_value(element, path) for element in value]
+        return [{} if item is _MISSING else item for item in items]
+    if isinstance(value, dict) and path[0] in value:
+        sub_value = _project_value(value[path[0]], path[1:])
+        return _MISSING if sub_value is _MISSING else {path[0]: sub_value}
+    return _MISSING
+
+def _merge_projection(target, value):
+    # 将一个字段的投影结果合并进结果字典（同一前缀下的多个字段合并到一起）
+    for key, item in value.items():
+        existing = target.get(key)
+        if isinstance(existing, dict) and isinstance(item, dict):
+            _merge_projection(existing, item)
+        elif isinstance(existing, list) and isinstance(item, list) and len(existing) == len(item):
+            for existing_item, sub_item in zip(existing, item):
+                if isinstance(existing_item, dict) and isinstance(sub_item, dict):
+                    _merge_projection(existing_item, sub_item)
+        else:
+            target[key] = item
+
+def validate_weather_projection(view=None, fields=None):
+    """
+    校验天气数据投影参数
+    :param view: 预设视图名称
+    :param fields: 逗号分隔的字符串或字段路径字符串列表
+    :raises ValueError: 视图名称不存在或字段格式不正确
+    """
+    if view and (not isinstance(view, str) or view not in WEATHER_VIEWS):
+        raise ValueError(f"不支持的视图: {view}")
+    if fields and not isinstance(fields, str) and \
+            not (isinstance(fields, list) and all(isinstance(field, str) for field in fields)):
+        raise ValueError("fields 必须是逗号分隔的字符串或字符串列表")
+
+def project_weather_data(weather_data, view=None, fields=None):
+    """
+    按预设视图或字段列表裁剪天气数据，减小响应体积
+    :param weather_data: 原始天气数据
+    :param view: 预设视图名称（'current'、'summary'、'full'），与 fields 同时提供时以 fields 为准
+    :param fields: 逗号分隔的字符串或字段路径列表，如 'current.temp,daily.temp'
+    :return: 裁剪后的天气数据，未指定视图和字段时原样返回
+    :raises ValueError: 视图名称不存在或字段格式不正确
+    """
+    if not weather_data:
+        return weather_data
+    validate_weather_projection(view, fields)
+    if fields:
+        if isinstance(fields, str):
+            fields = fields.split(',')
+        paths = [field.strip() for field in fields if field and field.strip()]
+    else:
+        paths = WEATHER_VIEWS.get(view or 'full')
+    if paths is None:
+        return weather_data
+
+    projected = {}
+    for field in paths:
+        value = _project_value(weather_data, field.split('.'))
+        if value is not _MISSING:
+            _merge_projection(projected, value)
+    return projected
+
 def format_weather_data(weather_data):
     """
     格式化天气数据为更易读的文本
@@ -84,6 +173,52 @@ def format_weather_data(weather_data):
         print(f"格式化天气数据时出错: {e}")
         return "天气数据格式错误"
 
+def get_alert_key(alert):
+    """
+    计算预警的唯一标识：对 (发布单位, 事件, 开始时间, 结束时间) 取哈希
+    同一条预警在有效期内多次刷新得到的标识相同，用于去重存储
+    :param alert: 原始预警字典（One Call API 中 alerts 的单个元素）
+    :return: 十六进制哈希字符串
+    """
+    raw = f"{alert.get('sender_name', '')}|{alert.get('event', '')}|{alert.get('start', '')}|{alert.get('end', '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _format_alert_time(timestamp):
+    # 转换时间戳为可读格式，缺失或无效时显示“未知”
+    try:
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+    except (TypeError, ValueError, OverflowError, OSError):
+        return '未知'
+
+def format_alert(alert):
+    """
+    将单条原始预警格式化为展示文本（按预警标识缓存，避免每次刷新重复格式化）
+    缺少字段的预警也能格式化，避免一条异常预警导致整条天气记录保存失败
+    :param alert: 原始预警字典
+    :return: 格式化后的字符串
+    """
+    key = get_alert_key(alert)
+    cached = _formatted_alert_cache.get(key)
+    if cached is not None:
+        return cached
+
+    start_time = _format_alert_time(alert.get('start'))
+    end_time = _format_alert_time(alert.get('end'))
+
+    # 构建预警信息字符串
+    alert_info = (
+        f"⚠️ {alert.get('event', '未知预警')}\n"
+        f"🕐 时间: {start_time} - {end_time}\n"
+        f"📝 描述: {alert.get('description', '')}\n"
+        f"🏢 发布单位: {alert.get('sender_name', '')}"
+    )
+
+    # 缓存过大时直接清空，预警数量本身很少，不需要更精细的淘汰策略
+    if len(_formatted_alert_cache) >= ALERT_CACHE_SIZE:
+        _formatted_alert_cache.clear()
+    _formatted_alert_cache[key] = alert_info
+    return alert_info
+
 def get_weather_alerts(weather_data):
     """
     提取并格式化天气预警信息
@@ -98,21 +233,12 @@ def get_weather_alerts(weather_data):
     try:
         # 遍历所有预警信息
         for alert in weather_data['alerts']:
-            # 转换时间戳为可读格式
-            start_time = datetime.fromtimestamp(alert['start']).strftime('%Y-%m-%d %H:%M')
-            end_time = datetime.fromtimestamp(alert['end']).strftime('%Y-%m-%d %H:%M')
-            
-            # 构建预警信息字符串
-            alert_info = (
-                f"⚠️ {alert['event']}\n"
-                f"🕐 时间: {start_time} - {end_time}\n"
-                f"📝 描述: {alert['description']}\n"
-                f"🏢 发布单位: {alert['sender_name']}"
-            )
-            
-            alerts.append(alert_info)
+            if not isinstance(alert, dict):
+                # 格式异常的预警跳过，不影响其余预警的展示
+                continue
+            alerts.append(format_alert(alert))
             
     except Exception as e:
         print(f"处理预警信息时出错: {e}")
     
-    return alerts
\ No newline at end of file
+    return alerts
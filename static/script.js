@@ -8,6 +8,7 @@ let schedulerActive = false;
 let autoUpdateTimer = null; // 定时器
 let previousWeatherData = null; // 保存上一次天气数据
 let lastUpdateWeatherData = null; // 保存上次更新时的天气数据
+const WEATHER_VIEW = 'current'; // 天气响应只返回页面展示需要的字段，生成建议时后端按记录ID读取完整数据
 
 // 页面加载完成后执行
 document.addEventListener('DOMContentLoaded', function () {
@@ -136,7 +137,8 @@ function getWeatherDataWithRetry(lat, lon, retryCount, sourceType = '手动更
         },
         body: JSON.stringify({
             lat: lat,
-            lon: lon
+            lon: lon,
+            view: WEATHER_VIEW
         })
     })
         .then(response => {
@@ -223,14 +225,76 @@ function updateWeatherDisplay(data, sourceType = '手动更新') {
     console.log("后端返回的天气数据：", weather);
 }
 
-// 自动刷新天气和AI建议
+// 自动刷新天气和AI建议（一次请求完成：服务端获取天气后提交后台建议任务）
 function autoUpdateWeatherAndAdvice() {
     if (!currentLocation) return;
     previousWeatherData = currentWeatherData;
-    getWeatherDataWithRetry(currentLocation.lat, currentLocation.lon, 0, '自动更新');
-    setTimeout(() => {
-        getAdviceWithRetry(currentWeatherData, lastUpdateWeatherData, previousWeatherData, currentRecordId, false, 0);
-    }, 1000);
+    refreshWithRetry(currentLocation.lat, currentLocation.lon, 0);
+}
+
+function refreshWithRetry(lat, lon, retryCount) {
+    let weatherReceived = false;
+    fetch('/refresh', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            lat: lat,
+            lon: lon,
+            source: 'auto',
+            force_update: false,
+            view: WEATHER_VIEW
+        })
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP错误! 状态码: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || '获取天气数据失败');
+            }
+            weatherReceived = true;
+            updateWeatherDisplay(data, '自动更新');
+            console.log("天气数据获取成功");
+            if (!data.advice_job) {
+                throw new Error(data.advice_error || '提交建议任务失败');
+            }
+            if (data.advice_job.status === 'done') {
+                // 快速判断已随刷新结果一起返回，无需轮询
+                return data.advice_job;
+            }
+            if (data.advice_job.status === 'failed') {
+                throw new Error(data.advice_job.error || '生成建议失败');
+            }
+            return waitForAdviceJob(data.advice_job.job_id);
+        })
+        .then(job => {
+            // 自动更新时，只有收到AI响应时才刷新自动更新时间
+            setText('last-auto-update', '最后自动更新: ' + formatDateTime(new Date()));
+            if (job.need_update && job.advice) {
+                setHTML('advice-info', marked.parse(job.advice));
+                setText('advice-update-type', '自动更新');
+                setText('advice-update-time', formatDateTime(new Date()));
+                lastUpdateWeatherData = currentWeatherData;
+            }
+            console.log("AI建议判断完成");
+        })
+        .catch(error => {
+            if (weatherReceived) {
+                // 天气已更新，只是建议失败，不重复获取天气
+                console.error('获取AI建议失败:', error);
+            } else if (retryCount < 4) {
+                setText('weather-info', `请求失败，正在重试第${retryCount + 1}次...`);
+                setTimeout(() => refreshWithRetry(lat, lon, retryCount + 1), 2000);
+            } else {
+                setText('weather-info', `获取天气数据失败: ${error.message}`);
+                console.error('自动刷新失败:', error);
+            }
+        });
 }
 
 // 获取AI建议（手动）
@@ -250,25 +314,13 @@ function getAdvice() {
 }
 
 function getAdviceWithRetry(weatherData, lastUpdateWeatherData, previousWeatherData, recordId, forceUpdate, retryCount, button) {
-    fetch('/get_advice', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json'
-        },
-        body: JSON.stringify({
-            weather_data: weatherData,
-            last_update_weather_data: lastUpdateWeatherData,
-            previous_weather_data: previousWeatherData,
-            record_id: recordId,
-            force_update: forceUpdate
-        })
+    requestAdviceJob({
+        weather_data: weatherData,
+        last_update_weather_data: lastUpdateWeatherData,
+        previous_weather_data: previousWeatherData,
+        record_id: recordId,
+        force_update: forceUpdate
     })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error(`HTTP错误! 状态码: ${response.status}`);
-            }
-            return response.json();
-        })
         .then(data => {
             // 自动更新时，只有收到AI响应时才刷新自动更新时间
             if (!forceUpdate) {
@@ -304,6 +356,45 @@ function getAdviceWithRetry(weatherData, lastUpdateWeatherData, previousWeatherD
         });
 }
 
+// 提交后台建议任务，并等待任务完成
+function requestAdviceJob(payload) {
+    return fetch('/advice_jobs', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(payload)
+    })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP错误! 状态码: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(job => waitForAdviceJob(job.job_id));
+}
+
+// 轮询查询建议任务状态，直到任务完成或失败（服务端只短暂等待，客户端按退避间隔重试）
+function waitForAdviceJob(jobId, delay = 500) {
+    return fetch(`/advice_jobs/${jobId}?wait=1`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP错误! 状态码: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(job => {
+            if (job.status === 'done') {
+                return job;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || '生成建议失败');
+            }
+            return new Promise(resolve => setTimeout(resolve, delay))
+                .then(() => waitForAdviceJob(jobId, Math.min(delay * 2, 5000)));
+        });
+}
+
 // 定时更新控制
 function startScheduler() {
     if (!currentLocation) {